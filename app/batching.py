@@ -0,0 +1,256 @@
+import asyncio
+from abc import ABC, abstractmethod
+
+import httpx
+import orjson
+from eth_abi import decode_abi
+from web3 import Web3
+
+# Multicall3 is deployed at the same address on Polygon and most other EVM chains
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+MULTICALL3_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"internalType": "address", "name": "target", "type": "address"},
+                    {"internalType": "bool", "name": "allowFailure", "type": "bool"},
+                    {"internalType": "bytes", "name": "callData", "type": "bytes"},
+                ],
+                "internalType": "struct Multicall3.Call3[]",
+                "name": "calls",
+                "type": "tuple[]",
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"internalType": "bool", "name": "success", "type": "bool"},
+                    {"internalType": "bytes", "name": "returnData", "type": "bytes"},
+                ],
+                "internalType": "struct Multicall3.Result[]",
+                "name": "returnData",
+                "type": "tuple[]",
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function",
+    }
+]
+
+
+class ContributionsBatcher(ABC):
+    """
+    Coalesce concurrent `contributions(address)` reads on a pooling contract into
+    a single request to the node.
+
+    The first queued read opens a short debounce window (`wait` seconds); all reads
+    queued before it closes are fetched together by `_fetch()`.
+    """
+
+    def __init__(self, web3: Web3, contract, wait: float = 0.01, max_batch_size: int = 500):
+        self.web3 = web3
+        self.contract = contract
+        self.wait = wait
+        self.max_batch_size = max_batch_size
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    async def contributions(self, address: str, block_identifier="latest") -> int:
+        """
+        Return the pooling contract's `contributions(address)` in wei, as of
+        block_identifier.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((address, block_identifier, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            pending = [await self._queue.get()]
+            await asyncio.sleep(self.wait)
+            while not self._queue.empty() and len(pending) < self.max_batch_size:
+                pending.append(self._queue.get_nowait())
+            # Reads pinned to different blocks can't share a call
+            by_block = {}
+            for address, block_identifier, future in pending:
+                by_block.setdefault(block_identifier, []).append((address, future))
+            for block_identifier, reads in by_block.items():
+                await self._fetch_and_resolve(reads, block_identifier)
+
+    async def _fetch_and_resolve(self, reads: list, block_identifier):
+        addresses = [address for address, _ in reads]
+        try:
+            results = await self._fetch(addresses, block_identifier)
+        except Exception as e:
+            results = [e] * len(reads)
+        for (_, future), result in zip(reads, results):
+            if future.done():  # the caller has gone away
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def aclose(self):
+        """
+        Stop batching reads and release the batcher's resources.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    @abstractmethod
+    async def _fetch(self, addresses: list, block_identifier) -> list:
+        """
+        Return the contribution (or the exception raised reading it) for each address.
+        """
+        pass
+
+    def _encode_contributions(self, address: str) -> str:
+        return self.contract.encodeABI(fn_name="contributions", args=[address])
+
+
+class MulticallBatcher(ContributionsBatcher):
+    """
+    Batch reads into one Multicall3 `aggregate3` eth_call.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.multicall = self.web3.eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
+
+    async def _fetch(self, addresses: list, block_identifier) -> list:
+        # web3's HTTPProvider is blocking, keep it off the event loop
+        return await asyncio.to_thread(self._aggregate, addresses, block_identifier)
+
+    def _aggregate(self, addresses: list, block_identifier) -> list:
+        calls = [
+            (self.contract.address, True, Web3.toBytes(hexstr=self._encode_contributions(a)))
+            for a in addresses
+        ]
+        results = []
+        for address, (success, return_data) in zip(
+            addresses,
+            self.multicall.functions.aggregate3(calls).call(block_identifier=block_identifier),
+        ):
+            if not success:
+                results.append(Exception(f"contributions({address}) reverted"))
+                continue
+            results.append(decode_abi(["uint256"], return_data)[0])
+        return results
+
+
+class BatchRejectedError(Exception):
+    """
+    Raised when a JSON-RPC node doesn't accept batch requests.
+    """
+
+
+class JsonRpcBatcher(ContributionsBatcher):
+    """
+    Batch reads into one JSON-RPC batch request (an array of eth_calls in a single
+    HTTP POST), for chains without a Multicall3 deployment.
+
+    Falls back to one eth_call per address if the node rejects batch requests;
+    other (e.g. transient 5xx or rate limiting) errors are passed to the callers.
+    """
+
+    # HTTP statuses with which nodes reject batch requests (or their size)
+    batch_rejected_status_codes = (400, 405, 413)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rpc_url = self.web3.provider.endpoint_uri
+        self.supports_batches = True
+        self._client = httpx.AsyncClient(timeout=10)
+
+    async def aclose(self):
+        await super().aclose()
+        await self._client.aclose()
+
+    async def _fetch(self, addresses: list, block_identifier) -> list:
+        if self.supports_batches:
+            try:
+                return await self._fetch_batch(addresses, block_identifier)
+            except BatchRejectedError as e:
+                print(f"JSON-RPC batch request rejected, falling back to single calls: {e}")
+                self.supports_batches = False
+        return await asyncio.gather(
+            *[self._fetch_single(address, block_identifier) for address in addresses],
+            return_exceptions=True,
+        )
+
+    async def _fetch_batch(self, addresses: list, block_identifier) -> list:
+        if isinstance(block_identifier, int):
+            block_identifier = hex(block_identifier)
+        payload = [
+            {
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "method": "eth_call",
+                "params": [
+                    {"to": self.contract.address, "data": self._encode_contributions(address)},
+                    block_identifier,
+                ],
+            }
+            for request_id, address in enumerate(addresses)
+        ]
+        response = await self._client.post(
+            self.rpc_url,
+            content=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"},
+        )
+        if response.status_code in self.batch_rejected_status_codes:
+            raise BatchRejectedError(f"{response.status_code}: {response.text}")
+        response.raise_for_status()
+        content = orjson.loads(response.content)
+        # Nodes without batch support reply with a single (error) object
+        if not isinstance(content, list):
+            raise BatchRejectedError(f"Unexpected JSON-RPC batch response: {content}")
+        # Responses to a batch may arrive in any order
+        replies = {reply["id"]: reply for reply in content}
+        results = []
+        for request_id, address in enumerate(addresses):
+            reply = replies.get(request_id, {"error": "missing from batch response"})
+            if "error" in reply:
+                results.append(Exception(f"contributions({address}) failed: {reply['error']}"))
+                continue
+            results.append(decode_abi(["uint256"], Web3.toBytes(hexstr=reply["result"]))[0])
+        return results
+
+    async def _fetch_single(self, address: str, block_identifier) -> int:
+        return await asyncio.to_thread(
+            self.contract.functions.contributions(address).call, block_identifier=block_identifier
+        )
+
+
+class BlockTracker:
+    """
+    Keep track of the chain's latest block number, refreshed every `interval`
+    seconds by a background task.
+
+    Reads pinned to a recent block, rather than "latest", give results that can be
+    cached and shared until the chain moves on.
+    """
+
+    def __init__(self, web3: Web3, interval: float = 3.0):
+        self.web3 = web3
+        self.interval = interval
+        self.block_number = web3.eth.block_number
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.block_number = await asyncio.to_thread(lambda: self.web3.eth.block_number)
+            except Exception as e:
+                print(f"Failed to update block number: {e}")
@@ -0,0 +1,40 @@
+from functools import lru_cache
+from typing import Literal
+
+import yaml
+from pydantic import BaseModel, ConfigDict
+
+# Prefer libyaml's C implementation if PyYAML was built with it
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+class Eligibility(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    contract_address: str
+    contract_abi_filename: str
+    min_nct_contribution: float
+    batching: Literal["multicall", "json-rpc"] = "multicall"
+
+
+class EventConfig(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    id: int
+    eligibility: Eligibility | None = None
+
+
+class DispenserConfig(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    events: tuple[EventConfig, ...]
+
+
+@lru_cache(maxsize=None)
+def load_config(filename: str) -> DispenserConfig:
+    """
+    Load and validate the dispenser's configuration from a yaml file.
+    """
+    with open(filename, "r") as file:
+        config = yaml.load(file, Loader=SafeLoader)
+    return DispenserConfig(**config["discarbon_poap_dispenser_api"])
@@ -1,22 +1,31 @@
-import json
 import os
+from decimal import Decimal
+from functools import lru_cache
 from textwrap import dedent
 
-import yaml
+import orjson
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from uvicorn.workers import UvicornWorker
 from web3 import Web3
 
 import app.wen_poap as wen_poap
+from app.batching import BlockTracker, JsonRpcBatcher, MulticallBatcher
+from app.config import load_config
 
 load_dotenv()
 
+config = load_config("config.yaml")
+
 
 class PoapApiUvicornWorker(UvicornWorker):
     CONFIG_KWARGS = {
         "log_config": "logging.yaml",
+        "loop": "uvloop",
+        "http": "httptools",
     }
 
 
@@ -76,46 +85,108 @@ poap_api.add_middleware(
 #    return response
 
 
+@lru_cache(maxsize=None)
 def load_abi(filename):
-    with open(filename, "r") as f:
-        abi = json.load(f)
+    with open(filename, "rb") as f:
+        abi = orjson.loads(f.read())
     return abi
 
 
+@lru_cache(maxsize=None)
+def get_web3(rpc_url):
+    """
+    Return a Web3 instance for rpc_url; events using the same RPC share its
+    provider's connection pool.
+    """
+    return Web3(Web3.HTTPProvider(rpc_url))
+
+
+@lru_cache(maxsize=None)
+def get_block_tracker(rpc_url):
+    """
+    Return the block tracker shared by all events using rpc_url.
+    """
+    return BlockTracker(get_web3(rpc_url))
+
+
+@lru_cache(maxsize=None)
+def get_contract(rpc_url, contract_address, abi_filename):
+    """
+    Return a contract object, shared by all events reading the same contract.
+    """
+    return get_web3(rpc_url).eth.contract(address=contract_address, abi=load_abi(abi_filename))
+
+
 class DevconEvent(wen_poap.EventABC):
+    # Seconds an address' eligibility is cached for; clients poll the same address repeatedly
+    eligibility_cache_ttl = 20
+    # Eligibility is read at, and cached per, buckets of this many blocks (~6s on Polygon)
+    eligibility_block_bucket = 3
+
     def __init__(self, *args, config=None):
         super().__init__(*args)
 
-        rpc_url = os.environ.get(f"RPC_URL_{config['id']}")
-        self.web3 = Web3(Web3.HTTPProvider(rpc_url))
+        rpc_url = os.environ.get(f"RPC_URL_{config.id}")
+        self.web3 = get_web3(rpc_url)
 
         # block_number = self.web3.eth.blockNumber
         # print(f"Connected: {self.web3.isConnected()}, block number: {block_number}")
         if not self.web3.isConnected():
             raise Exception("Failed to connect to Polygon RPC; unable to check eligibility")
-        self.contract_address = config["eligibility"]["contract_address"]
-        abi_filename = config["eligibility"]["contract_abi_filename"]
-        self.min_nct_contribution = config["eligibility"]["min_nct_contribution"]
-        abi = load_abi(abi_filename)
-        self.pooling_contract = self.web3.eth.contract(address=self.contract_address, abi=abi)
-
-    def is_eligible(self, to_address):
+        self.contract_address = config.eligibility.contract_address
+        abi_filename = config.eligibility.contract_abi_filename
+        self.min_nct_contribution = config.eligibility.min_nct_contribution
+        # Compare contributions in wei, as integers
+        self.min_nct_contribution_wei = int(
+            Decimal(str(self.min_nct_contribution)) * Decimal(10**18)
+        )
+        self.pooling_contract = get_contract(rpc_url, self.contract_address, abi_filename)
+        self.block_tracker = get_block_tracker(rpc_url)
+        self._eligibility_cache = TTLCache(maxsize=10_000, ttl=self.eligibility_cache_ttl)
+        # Concurrent eligibility checks share a single Multicall3 eth_call or, on
+        # chains without Multicall3, a single JSON-RPC batch request
+        if config.eligibility.batching == "json-rpc":
+            self._contributions = JsonRpcBatcher(self.web3, self.pooling_contract)
+        else:
+            self._contributions = MulticallBatcher(self.web3, self.pooling_contract)
+
+    async def initialize(self):
+        await super().initialize()
+        self.block_tracker.start()
+
+    async def aclose(self):
+        await self._contributions.aclose()
+
+    def _eligibility_cache_key(self, to_address):
+        block_number = self.block_tracker.block_number
+        block_number -= block_number % self.eligibility_block_bucket
+        return wen_poap.checksum_address(to_address), block_number
+
+    async def is_eligible(self, to_address):
         """
         Check whether an address is eligible for the POAP.
         """
-        to_address = Web3.toChecksumAddress(to_address)
-        nct_amount_wei = self.pooling_contract.functions.contributions(to_address).call()
-        nct_amount = Web3.fromWei(nct_amount_wei, "ether")
-        if nct_amount >= self.min_nct_contribution:
-            return True
-        return False
+        key = self._eligibility_cache_key(to_address)
+        is_eligible = self._eligibility_cache.get(key)
+        if is_eligible is not None:
+            return is_eligible
+        return await self._single_flight(("is_eligible", key), lambda: self._check_eligibility(key))
+
+    async def _check_eligibility(self, key):
+        to_address, block_number = key
+        nct_amount_wei = await self._contributions.contributions(to_address, block_number)
+        is_eligible = nct_amount_wei >= self.min_nct_contribution_wei
+        self._eligibility_cache[key] = is_eligible
+        return is_eligible
 
 
 events = {}
+poap_api_wrapper = None
 
 
 @poap_api.on_event("startup")
 async def startup_event():
+    global poap_api_wrapper
 
     # Load POAP API credentials from the environment
     api_key = os.environ.get("API_KEY")
@@ -123,27 +194,91 @@ async def startup_event():
     client_secret = os.environ.get("CLIENT_SECRET")
     audience = os.environ.get("AUDIENCE")
 
-    # TODO: check values are not none.
+    credentials = {
+        "API_KEY": api_key,
+        "CLIENT_ID": client_id,
+        "CLIENT_SECRET": client_secret,
+        "AUDIENCE": audience,
+    }
+    missing = [name for name, value in credentials.items() if not value]
+    if missing:
+        raise Exception(f"Missing environment variables: {', '.join(missing)}")
 
     # Initialize API wrapper; currently assumed constant for all events
-    poap_api = wen_poap.PoapApiWrapper(
+    poap_api_wrapper = wen_poap.PoapApiWrapper(
         "https://api.poap.tech/", audience, api_key, client_id, client_secret
     )
-    # Load configured events
-    with open("config.yaml", "r") as file:
-        config = yaml.safe_load(file)
+    await poap_api_wrapper.initialize()
 
     # Initialize configured events
-    for event_config in config["discarbon_poap_dispenser_api"]["events"]:
-        event_id = event_config["id"]
+    for event_config in config.events:
+        event_id = event_config.id
         event_secret = os.environ.get(f"SECRET_EVENT_{event_id}")
         print("Configuring...", event_id)
         if event_id in [62477, 71182, 71937]:
-            events[event_id] = DevconEvent(poap_api, event_id, event_secret, config=event_config)
+            for name in [f"SECRET_EVENT_{event_id}", f"RPC_URL_{event_id}"]:
+                if not os.environ.get(name):
+                    raise Exception(f"Missing environment variable {name} for event {event_id}")
+            event = DevconEvent(poap_api_wrapper, event_id, event_secret, config=event_config)
+            await event.initialize()
+            events[event_id] = event
+
+
+@poap_api.on_event("shutdown")
+async def shutdown_event():
+    # Release the events' and the POAP API wrapper's pooled connections
+    for event in events.values():
+        await event.aclose()
+    if poap_api_wrapper is not None:
+        await poap_api_wrapper.aclose()
+
+
+class RequestError(HTTPException):
+    """
+    An invalid request; reported as {"success": False, "message": ...} like all
+    other endpoint errors.
+    """
+
+    def __init__(self, message: str):
+        super().__init__(status_code=400, detail=message)
+
+
+@poap_api.exception_handler(RequestError)
+async def request_error_handler(request: Request, exc: RequestError):
+    return JSONResponse(
+        status_code=exc.status_code, content={"success": False, "message": exc.detail}
+    )
+
+
+async def resolve_event(event_id: int) -> wen_poap.EventABC:
+    """
+    Dependency returning the configured event for event_id.
+    """
+    event = events.get(event_id)
+    if event is None:
+        raise RequestError(f"error: event with id {event_id} is not configured")
+    return event
+
+
+async def resolve_event_and_address(
+    to_address: str, event: wen_poap.EventABC = Depends(resolve_event)
+) -> tuple[wen_poap.EventABC, str]:
+    """
+    Dependency returning the configured event for event_id and the checksum
+    version of to_address.
+    """
+    checksum_address = wen_poap.parse_address(to_address)
+    if checksum_address is None:
+        # TODO: allow ENS domain names (only standard address formats are accepted)
+        raise RequestError(
+            f"error: invalid Ethereum address {to_address} "
+            "(ENS domain names not currently supported)"
+        )
+    return event, checksum_address
 
 
 @poap_api.get("/", tags=["Auxiliary"])
-async def root():
+async def root() -> dict:
     """
     Return a helpful docstring pointing to the API's Swagger documentation if no
     valid endpoint is provided.
@@ -158,7 +293,7 @@ async def root():
 
 # If we have dependencies on other services, consider https://github.com/Kludex/fastapi-health
 @poap_api.get("/health", tags=["Auxiliary"])
-async def app_health():
+async def app_health() -> dict:
     """
     Basic health check to verify the API is still running.
     """
@@ -168,14 +303,13 @@ async def app_health():
 @poap_api.get("/getRemainingCodeCount/{event_id}", tags=["POAP Minting"])
 async def get_remaining_code_count(
     event_id: int,
-):
+    event: wen_poap.EventABC = Depends(resolve_event),
+) -> dict:
     """
     Return the number of unclaimed codes for the specified event.
     """
-    if event_id not in events.keys():
-        return {"success": False, "message": f"error: event with id {event_id} is not configured"}
     try:
-        code_count = events[event_id].get_remaining_code_count()
+        code_count = await event.get_remaining_code_count()
     except Exception as e:
         return {"success": False, "message": str(e)}
     return {
@@ -187,23 +321,15 @@ async def get_remaining_code_count(
 @poap_api.get("/isEligible/{event_id}/{to_address}", tags=["POAP Minting"])
 async def is_eligible(
     event_id: int,
-    to_address: str,
-):
+    resolved: tuple = Depends(resolve_event_and_address),
+) -> dict:
     """
     Return true if to_address is eligible to receive the POAP for event_id,
     false otherwise
     """
-    if event_id not in events.keys():
-        return {"success": False, "message": f"error: event with id {event_id} is not configured"}
-    if not Web3.isAddress(to_address):
-        # TODO: allow ENS domain names (isAddress() only checks standard address formats
-        return {
-            "success": False,
-            "message": f"error: invalid Ethereum address {to_address} "
-            "(ENS domain names not currently supported)",
-        }
+    event, to_address = resolved
     try:
-        is_eligible = events[event_id].is_eligible(to_address)
+        is_eligible = await event.is_eligible(to_address)
     except Exception as e:
         return {"success": False, "message": str(e)}
     return {
@@ -217,23 +343,15 @@ async def is_eligible(
 @poap_api.get("/hasCollected/{event_id}/{to_address}", tags=["POAP Minting"])
 async def has_collected(
     event_id: int,
-    to_address: str,
-):
+    resolved: tuple = Depends(resolve_event_and_address),
+) -> dict:
     """
     Return true if to_address has already collected the POAP for event_id,
     false otherwise
     """
-    if event_id not in events.keys():
-        return {"success": False, "message": f"error: event with id {event_id} is not configured"}
-    if not Web3.isAddress(to_address):
-        # TODO: allow ENS domain names (isAddress() only checks standard address formats
-        return {
-            "success": False,
-            "message": f"error: invalid Ethereum address {to_address} "
-            "(ENS domain names not currently supported)",
-        }
+    event, to_address = resolved
     try:
-        has_collected = events[event_id].has_collected(to_address)
+        has_collected = await event.has_collected(to_address)
     except Exception as e:
         return {"success": False, "message": str(e)}
     return {
@@ -247,23 +365,15 @@ async def has_collected(
 @poap_api.get("/getCollectorStatus/{event_id}/{to_address}", tags=["POAP Minting"])
 async def get_collector_status(
     event_id: int,
-    to_address: str,
-):
+    resolved: tuple = Depends(resolve_event_and_address),
+) -> dict:
     """
     Return true if to_address has already collected the POAP for event_id,
     false otherwise
     """
-    if event_id not in events.keys():
-        return {"success": False, "message": f"error: event with id {event_id} is not configured"}
-    if not Web3.isAddress(to_address):
-        # TODO: allow ENS domain names (isAddress() only checks standard address formats
-        return {
-            "success": False,
-            "message": f"error: invalid Ethereum address {to_address} "
-            "(ENS domain names not currently supported)",
-        }
+    event, to_address = resolved
     try:
-        collector_status = events[event_id].get_collector_status(to_address)
+        collector_status = await event.get_collector_status(to_address)
     except Exception as e:
         return {"success": False, "message": str(e)}
     return {
@@ -281,23 +391,14 @@ async def get_collector_status(
 )
 async def mint_poap(
     event_id: int,
-    to_address: str,
-):
+    resolved: tuple = Depends(resolve_event_and_address),
+) -> dict:
     """
     Mint a POAP from event specified by mint_id to to_address, if eligible.
     """
-    if event_id not in events.keys():
-        return {"success": False, "message": f"error: event with id {event_id} is not configured"}
-    if not Web3.isAddress(to_address):
-        # TODO: allow ENS domain names (isAddress() only checks standard address formats
-        return {
-            "success": False,
-            "message": f"error: invalid Ethereum address {to_address} "
-            "(ENS domain names not currently supported)",
-        }
-    to_address = Web3.toChecksumAddress(to_address)
+    event, to_address = resolved
     try:
-        response = events[event_id].mint_poap(to_address)
+        response = await event.mint_poap(to_address)
     except Exception as e:
         return {"success": False, "message": str(e)}
     return response
@@ -309,23 +410,14 @@ async def mint_poap(
 )
 async def mint_poap_with_eligibility_timeout(
     event_id: int,
-    to_address: str,
-):
+    resolved: tuple = Depends(resolve_event_and_address),
+) -> dict:
     """
     Mint a POAP from event specified by mint_id to to_address, if eligible.
     """
-    if event_id not in events.keys():
-        return {"success": False, "message": f"error: event with id {event_id} is not configured"}
-    if not Web3.isAddress(to_address):
-        # TODO: allow ENS domain names (isAddress() only checks standard address formats
-        return {
-            "success": False,
-            "message": f"error: invalid Ethereum address {to_address} "
-            "(ENS domain names not currently supported)",
-        }
-    to_address = Web3.toChecksumAddress(to_address)
+    event, to_address = resolved
     try:
-        response = events[event_id].wait_to_be_eligible_and_mint_poap(to_address, timeout=90)
+        response = await event.wait_to_be_eligible_and_mint_poap(to_address, timeout=90)
     except Exception as e:
         return {"success": False, "message": str(e)}
     return response
@@ -338,16 +430,15 @@ async def mint_poap_with_eligibility_timeout(
 async def wait_for_mint_with_timeout(
     event_id: int,
     uid: str,
-):
+    event: wen_poap.EventABC = Depends(resolve_event),
+) -> dict:
     """
     Get the current minting status.
 
     Comment: poap api return status code upon invalid uid, but not if the uid is valid.
     """
-    if event_id not in events.keys():
-        return {"success": False, "message": f"error: event with id {event_id} is not configured"}
     try:
-        content = events[event_id].wait_for_mint_tx_hash(uid)
+        content = await event.wait_for_mint_tx_hash(uid)
     except Exception as e:
         return {"success": False, "message": str(e)}
     operation = content["operation"]
@@ -369,16 +460,15 @@ async def wait_for_mint_with_timeout(
 async def get_mint_status(
     event_id: int,
     uid: str,
-):
+    event: wen_poap.EventABC = Depends(resolve_event),
+) -> dict:
     """
     Get the current minting status.
 
     Comment: poap api return status code upon invalid uid, but not if the uid is valid.
     """
-    if event_id not in events.keys():
-        return {"success": False, "message": f"error: event with id {event_id} is not configured"}
     try:
-        content = events[event_id].get_uid_status(uid)
+        content = await event.get_uid_status(uid)
     except Exception as e:
         return {"success": False, "message": str(e)}
     operation = content["operation"]
@@ -1,12 +1,55 @@
-import json
-import pickle
-import sys
+import asyncio
+import random
+import tempfile
 import time
 from abc import ABC, abstractmethod
-from datetime import datetime, timedelta
+from collections import deque
+from collections.abc import Callable
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from enum import Enum
+from functools import lru_cache
+from itertools import compress, filterfalse
+from operator import itemgetter, not_
+from pathlib import Path
 
-import requests
+import httpx
+import orjson
+import tenacity
+from cachetools import LRUCache, TLRUCache
+from eth_utils import is_hex_address
+from web3 import Web3
+
+
+@lru_cache(maxsize=8192)
+def _checksum(address: str) -> str:
+    return Web3.toChecksumAddress(address)
+
+
+def checksum_address(address: str) -> str:
+    """
+    Return the EIP-55 checksum version of an address. Results are cached, as the
+    same addresses are checked over and over by polling clients.
+    """
+    return _checksum(address.lower())
+
+
+def parse_address(address: str) -> str | None:
+    """
+    Return the checksum version of address, or None if it isn't a valid address.
+
+    Equivalent to `Web3.isAddress()` followed by `checksum_address()`, but hashes
+    the address only once.
+    """
+    if not is_hex_address(address):
+        return None
+    checksummed = checksum_address(address)
+    hex_digits = address[2:] if address.startswith(("0x", "0X")) else address
+    # Mixed-case addresses are checksummed and must match (EIP-55)
+    is_mixed_case = hex_digits not in (hex_digits.lower(), hex_digits.upper())
+    if is_mixed_case and address != checksummed:
+        return None
+    return checksummed
 
 
 class CollectorStatus(str, Enum):
@@ -19,8 +62,38 @@ class CollectorStatus(str, Enum):
     has_collected = "address has collected the POAP for the event"
 
 
+def _retry_after(response: httpx.Response) -> float | None:
+    """
+    Return the delay in seconds requested by a response's Retry-After header, if any.
+    """
+    retry_after = response.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return float(retry_after)
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class OAuthRefreshError(Exception):
+    """
+    Raised when no oauth access token could be obtained from POAP's auth server.
+    """
+
+
 class PoapApiWrapper:
-    oauth_token_filename = "./poap_oauth_token.pkl"
+    oauth_token_filename = "./poap_oauth_token.json"
+    # Rate limiting and server errors from the POAP API that are retried with
+    # exponential backoff, or after the delay given by a Retry-After header. POSTs
+    # (e.g. claiming a code) may have been processed despite a 500/502/504, so
+    # they're only retried when the server certainly didn't handle them
+    retry_status_codes = (429, 500, 502, 503, 504)
+    post_retry_status_codes = (429, 503)
+    max_retries = 6
+    retry_backoff_factor = 0.5
 
     def __init__(
         self,
@@ -29,24 +102,89 @@ class PoapApiWrapper:
         api_key: str,
         client_id: str,
         client_secret: str,
+        max_requests_per_minute: int | None = None,
     ):
         self.api_endpoint = poap_api_endpoint
         self.audience = audience
         self.api_key = api_key
         self.client_id = client_id
         self.client_secret = client_secret
-        # Get and save oauth access token
+        # Optional client-side cap on the request rate, and when the server's
+        # rate limit headers ask us to hold off until (time.monotonic())
+        self.max_requests_per_minute = max_requests_per_minute
+        self._request_times = deque()
+        self._throttled_until = 0.0
+        # Number of responses that were rate limited (429) or asked us to slow down,
+        # for callers that adapt their concurrency to it
+        self.rate_limited_responses = 0
+        # Shared client; connections to the POAP API are kept alive between requests
+        # (and multiplexed over HTTP/2) and failed connection attempts are retried by
+        # the transport
+        self._client: httpx.AsyncClient = httpx.AsyncClient(
+            base_url=poap_api_endpoint,
+            headers={"Accept": "application/json", "X-API-Key": api_key},
+            timeout=10,
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=self.max_retries,
+                limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            ),
+        )
         self.access_token = None
-        self.access_token_expiry = datetime.now()
+        # Expiry in epoch seconds, for the token file, and the equivalent
+        # time.monotonic() deadline used to check for expiry on every request
+        self.access_token_expiry = int(time.time())
+        self._access_token_deadline = time.monotonic()
+        self._last_saved_token = None
+        self._oauth_token_refresh = None
+        self._etag_cache = LRUCache(maxsize=10_000)
         self.load_oauth_token()
+
+    async def initialize(self):
+        """
+        Request a new oauth access token if none could be loaded from file or if
+        the loaded token has expired.
+        """
         if not self.access_token or self.has_oauth_token_expired():
-            self.update_oauth_token()
+            await self.update_oauth_token()
+
+    async def ensure_oauth_token(self):
+        """
+        Refresh the oauth access token if it has expired. The token is kept in
+        memory until then; concurrent requests that find it expired share a single
+        refresh, and its outcome (including OAuthRefreshError), rather than each
+        requesting a new token.
+        """
+        if not self.has_oauth_token_expired():
+            return
+        if self._oauth_token_refresh is None:
+            self._oauth_token_refresh = asyncio.ensure_future(self.update_oauth_token())
+            self._oauth_token_refresh.add_done_callback(self._oauth_token_refreshed)
+        # Shielded so that one caller going away doesn't cancel the others' refresh
+        await asyncio.shield(self._oauth_token_refresh)
+
+    def _oauth_token_refreshed(self, future: asyncio.Future):
+        self._oauth_token_refresh = None
 
-    # TODO retry + exponential backoff with tenacity
-    def update_oauth_token(self):
+    async def aclose(self):
+        """
+        Close the underlying HTTP client and its pooled connections.
+        """
+        await self._client.aclose()
+
+    @tenacity.retry(
+        stop=tenacity.stop_after_attempt(5),
+        wait=tenacity.wait_exponential(multiplier=1, max=30),
+        retry=tenacity.retry_if_exception_type(OAuthRefreshError),
+        reraise=True,
+    )
+    async def update_oauth_token(self):
         """
         Request an OAuth token from POAP's oauth endpoint and store it
         for future use.
+
+        Failed requests are retried with exponential backoff; OAuthRefreshError is
+        raised if they all fail.
         """
         url = "https://poapauth.auth0.com/oauth/token"
         headers = {"Content-Type": "application/json"}
@@ -56,91 +194,221 @@ class PoapApiWrapper:
             "client_id": self.client_id,
             "client_secret": self.client_secret,
         }
-        response = requests.request("POST", url, headers=headers, data=json.dumps(data))
-        if not response.ok:
-            print(
+        request = self._client.build_request(
+            "POST", url, headers=headers, content=orjson.dumps(data)
+        )
+        # The API key is only meant for POAP's API, not for its auth server
+        del request.headers["X-API-Key"]
+        try:
+            response = await self._client.send(request)
+        except httpx.TransportError as e:
+            raise OAuthRefreshError(f"Error requesting auth token: {e}") from e
+        if not response.is_success:
+            raise OAuthRefreshError(
                 f"Error requesting auth token ({response.status_code}), "
-                f'reason: "{response.reason}"; text: "{response.text}"'
+                f'reason: "{response.reason_phrase}"; text: "{response.text}"'
             )
-            sys.exit(1)
-        data = json.loads(response.content)
+        data = orjson.loads(response.content)
         self.access_token = data["access_token"]
-        self.access_token_expiry = datetime.now() + timedelta(seconds=data["expires_in"] - 600)
+        lifetime = data["expires_in"] - 600
+        self.access_token_expiry = int(time.time()) + lifetime
+        self._access_token_deadline = time.monotonic() + lifetime
         self.save_oauth_token()
 
     def has_oauth_token_expired(self):
-        return datetime.now() >= self.access_token_expiry
+        return time.monotonic() >= self._access_token_deadline
 
     def save_oauth_token(self):
         """
         Save access token to disk to avoid getting rate limited by POAP's auth
         server. More relevant during testing than during production.
+
+        The file is written atomically and only if the token has changed.
         """
-        with open(self.oauth_token_filename, "wb") as f:
-            pickle.dump([self.access_token, self.access_token_expiry], f)
+        if self.access_token == self._last_saved_token:
+            return
+        # A temporary file of our own, as other workers may be saving a token too
+        token_path = Path(self.oauth_token_filename)
+        with tempfile.NamedTemporaryFile(
+            dir=token_path.parent, prefix=f"{token_path.name}.", delete=False
+        ) as f:
+            f.write(
+                orjson.dumps({"token": self.access_token, "expiry_epoch": self.access_token_expiry})
+            )
+        Path(f.name).replace(token_path)
+        self._last_saved_token = self.access_token
 
     def load_oauth_token(self):
         try:
-            with open(self.oauth_token_filename, "rb") as f:
-                self.access_token, self.access_token_expiry = pickle.load(f)
+            data = orjson.loads(Path(self.oauth_token_filename).read_bytes())
+            self.access_token = data["token"]
+            self.access_token_expiry = data["expiry_epoch"]
+            remaining = self.access_token_expiry - time.time()
+            self._access_token_deadline = time.monotonic() + remaining
+            self._last_saved_token = self.access_token
             print("Successfully loaded oauth access token from file.")
         except Exception as e:
             print(f"Failed to load oauth access token from file: {e}")
 
-    def get(self, route: str, protected: bool = True):
-        if self.has_oauth_token_expired():
-            self.update_oauth_token()
-        url = f"{self.api_endpoint}{route}"
-        headers = {
-            "Accept": "application/json",
-            "X-API-Key": self.api_key,
-        }
+    async def _request(
+        self, method: str, route: str, protected: bool, headers: dict, **kwargs
+    ) -> httpx.Response:
+        """
+        Send a request to the POAP API, retrying rate limiting and server errors
+        (only rate limiting and 503s for POSTs) with exponential backoff, or as
+        instructed by Retry-After. The last response is returned if all retries are
+        exhausted.
+
+        A 503 response is returned if a protected route can't be requested because
+        no oauth access token could be obtained.
+        """
         if protected:
+            try:
+                await self.ensure_oauth_token()
+            except OAuthRefreshError as e:
+                request = self._client.build_request(method, route)
+                return httpx.Response(503, text=str(e), request=request)
             headers["Authorization"] = f"Bearer {self.access_token}"
-        # Test/retry for bad response
-        response = requests.get(url, headers=headers)
+        retry_status_codes = (
+            self.retry_status_codes if method == "GET" else self.post_retry_status_codes
+        )
+        for attempt in range(self.max_retries + 1):
+            await self.wait_if_throttled()
+            response = await self._client.request(method, route, headers=headers, **kwargs)
+            self._update_throttle(response)
+            if response.status_code not in retry_status_codes or attempt == self.max_retries:
+                break
+            await asyncio.sleep(self._retry_delay(response, attempt))
         return response
 
-    def post(self, route: str, payload: dict, protected: bool = True):
-        if self.has_oauth_token_expired():
-            self.update_oauth_token()
-        url = f"{self.api_endpoint}{route}"
-        headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "X-API-Key": self.api_key,
-        }
-        if protected:
-            headers["Authorization"] = f"Bearer {self.access_token}"
-        # Test/retry for bad response
-        response = requests.post(url, headers=headers, json=payload)
+    async def wait_if_throttled(self):
+        """
+        Wait until the POAP API's rate limit, and our own requests per minute cap
+        (if set), allow another request to be sent.
+        """
+        delay = self._throttled_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if not self.max_requests_per_minute:
+            return
+        while True:
+            now = time.monotonic()
+            while self._request_times and self._request_times[0] <= now - 60:
+                self._request_times.popleft()
+            if len(self._request_times) < self.max_requests_per_minute:
+                break
+            await asyncio.sleep(self._request_times[0] + 60 - now)
+        self._request_times.append(now)
+
+    def _update_throttle(self, response: httpx.Response):
+        # Back off before the server's rate limit is used up, rather than running into 429s
+        remaining = response.headers.get("X-RateLimit-Remaining", "")
+        if response.status_code == 429 or (remaining.isdigit() and int(remaining) <= 2):
+            self.rate_limited_responses += 1
+        if remaining.isdigit() and int(remaining) <= 2:
+            delay = _retry_after(response)
+            self._throttled_until = time.monotonic() + (1.0 if delay is None else delay)
+
+    def _retry_delay(self, response: httpx.Response, attempt: int) -> float:
+        backoff = self.retry_backoff_factor * 2**attempt
+        retry_after = _retry_after(response)
+        if retry_after is None:
+            return backoff
+        return max(retry_after, backoff)
+
+    async def get(self, route: str, protected: bool = True) -> httpx.Response:
+        """
+        Send a GET request to the POAP API. If a previous response for route carried
+        an ETag, the request is made conditional and the previous response is
+        returned if the server replies 304 Not Modified.
+        """
+        headers = {}
+        cached_response = self._etag_cache.get(route)
+        if cached_response is not None:
+            headers["If-None-Match"] = cached_response.headers["ETag"]
+        response = await self._request("GET", route, protected, headers=headers)
+        if response.status_code == 304 and cached_response is not None:
+            return cached_response
+        if response.status_code == 200 and "ETag" in response.headers:
+            self._etag_cache[route] = response
         return response
 
+    async def post(self, route: str, payload: dict, protected: bool = True) -> httpx.Response:
+        headers = {"Content-Type": "application/json"}
+        response = await self._request(
+            "POST", route, protected, headers=headers, content=orjson.dumps(payload)
+        )
+        return response
+
+
+def _uid_status_expiry(uid: str, status: dict, now: float) -> float:
+    # Finished mints (FINISH, FINISH_WITH_ERROR) won't change status again
+    if status["status"].startswith("FINISH"):
+        return now + 300
+    return now + 1
+
 
 class EventABC(ABC):
+    remaining_code_count_ttl = 10
+
     def __init__(self, poap_api: PoapApiWrapper, event_id: int, event_secret: str):
         self.poap_api = poap_api
         self.event_id = event_id
         self.event_secret = event_secret
-        assert (
-            self.is_valid_event()
-        ), f"event/validate claims the event with id {event_id} is not valid."
         self.qr_codes = None
-        self.update_unclaimed_qr_codes()
+        self._issued: set[str] = set()
+        # Addresses known to have collected the POAP; collecting can't be undone
+        self._collected: set[str] = set()
+        # Number of unclaimed codes the POAP API last reported, and when
+        self._unclaimed_count = 0
+        self._unclaimed_count_updated = 0.0
+        self._uid_status_cache = TLRUCache(maxsize=10_000, ttu=_uid_status_expiry)
+        self._inflight = {}
 
-    def get_remaining_code_count(self) -> int:
+    async def _single_flight(self, key: tuple, coro_factory):
         """
-        Return the number of unclaimed codes remaining for the event
+        Await coro_factory(), sharing its result (or exception) with any concurrent
+        callers using the same key instead of running it again for each of them.
+        """
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(coro_factory())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded so that one caller going away doesn't cancel the others' request
+        return await asyncio.shield(future)
+
+    async def initialize(self) -> None:
+        """
+        Validate the event with the POAP API and fetch its unclaimed codes.
+        """
+        assert (
+            await self.is_valid_event()
+        ), f"event/validate claims the event with id {self.event_id} is not valid."
+        self.qr_codes = deque()
+        await self.update_unclaimed_qr_codes()
+
+    async def get_remaining_code_count(self) -> int:
+        """
+        Return the number of unclaimed codes remaining for the event, as reported by
+        the POAP API (at most remaining_code_count_ttl seconds ago).
+
+        Each worker queues its own copy of the codes, so the length of qr_codes
+        would overstate the codes left for the event as a whole.
         """
         if self.qr_codes is None:
             raise Exception(
                 "Event `qr_codes` object is not initialized, call "
                 "`update_unclaimed_qr_codes()` first"
             )
-        return len(self.qr_codes)
+        if time.monotonic() - self._unclaimed_count_updated > self.remaining_code_count_ttl:
+            await self._single_flight(
+                ("update_unclaimed_qr_codes",), self.update_unclaimed_qr_codes
+            )
+        return self._unclaimed_count
 
     @abstractmethod
-    def is_eligible(self, address: str) -> bool:
+    async def is_eligible(self, address: str) -> bool:
         """
         Check whether an address is eligible to receive a POAP for this event drop.
 
@@ -149,104 +417,237 @@ class EventABC(ABC):
         """
         pass
 
-    def has_collected(self, address: str) -> bool:
+    async def aclose(self) -> None:
+        """
+        Release any resources held by the event, other than the shared POAP API
+        wrapper.
+
+        Concrete classes that hold connections of their own must override this
+        method.
+        """
+        pass
+
+    async def has_collected(self, address: str) -> bool:
         """
         Check whether an address has already collected (minted) this event's POAP.
         """
-        response = self.poap_api.get(f"actions/scan/{address}/{self.event_id}", protected=False)
+        if address in self._collected:
+            return True
+        response = await self.poap_api.get(
+            f"actions/scan/{address}/{self.event_id}", protected=False
+        )
         if response.status_code == 404:
             return False
         if response.status_code == 200:
+            self._collected.add(address)
             return True
         raise Exception(
-            f"Unexpected status code: {response.status_code}, {response.reason}, {response.text}"
+            f"Unexpected status code: {response.status_code}, {response.reason_phrase}, "
+            f"{response.text}"
         )
 
-    def get_collector_status(self, address: str) -> CollectorStatus:
+    async def get_collector_status(
+        self, address: str, already_eligible: bool = False
+    ) -> CollectorStatus:
+        """
+        Check whether an address has collected the POAP and, if not, whether it's
+        eligible for it (unless the caller has already_eligible). Collecting is
+        checked first as it settles the status either way.
+        """
         try:
-            if self.has_collected(address):
+            if await self.has_collected(address):
                 return CollectorStatus.has_collected
-            if not self.is_eligible(address):
+            if not already_eligible and not await self.is_eligible(address):
                 return CollectorStatus.is_not_eligible
         except Exception as e:
             raise Exception(f"Unexpected error: {e}")
         return CollectorStatus.is_eligible
 
-    def is_valid_event(self) -> bool:
-        response = self.validate_event()
+    async def is_valid_event(self) -> bool:
+        response = await self.validate_event()
         is_valid = response["valid"]
         return is_valid
 
-    def validate_event(self) -> dict:
+    async def validate_event(self) -> dict:
+        return await self._single_flight(("validate_event",), self._validate_event)
+
+    async def _validate_event(self) -> dict:
         payload = {"event_id": self.event_id, "secret_code": self.event_secret}
-        poap_response = self.poap_api.post("event/validate", payload)
+        poap_response = await self.poap_api.post("event/validate", payload)
         if poap_response.status_code != 200:
             raise Exception(
                 f"Unexpected status code validating event: {poap_response.status_code}: "
-                f"{poap_response.reason}, {poap_response.text}"
+                f"{poap_response.reason_phrase}, {poap_response.text}"
             )
-        return json.loads(poap_response.content)
+        return orjson.loads(poap_response.content)
 
-    def update_unclaimed_qr_codes(self) -> None:
+    async def update_unclaimed_qr_codes(self) -> None:
+        """
+        Fetch the event's codes from the POAP API, queue the unclaimed codes that
+        are not already queued or handed out and drop queued codes that have since
+        been claimed (e.g. by another worker).
+        """
         payload = {"secret_code": self.event_secret}
-        response = self.poap_api.post(f"event/{self.event_id}/qr-codes", payload)
-        qr_codes = json.loads(response.content)
-        unclaimed_qr_codes = [qr["qr_hash"] for qr in qr_codes if qr["claimed"] is False]
-        self.qr_codes = unclaimed_qr_codes
-
-    def claim_qr_get_secret(self, qr_code: str) -> str:
-        response = self.poap_api.get(f"actions/claim-qr?qr_hash={qr_code}")
-        content = json.loads(response.content)
-        assert not content["claimed"], "qr hash already claimed"
+        response = await self.poap_api.post(f"event/{self.event_id}/qr-codes", payload)
+        if response.status_code != 200:
+            raise Exception(
+                f"Unexpected status code fetching qr codes: {response.status_code}: "
+                f"{response.reason_phrase}, {response.text}"
+            )
+        qr_codes = orjson.loads(response.content)
+        self._unclaimed_count_updated = time.monotonic()
+        if not qr_codes:
+            self._unclaimed_count = 0
+            return
+        # Events can have many thousands of codes; keep the filtering in C
+        qr_hashes, claimed = zip(*map(itemgetter("qr_hash", "claimed"), qr_codes))
+        self._unclaimed_count = len(claimed) - sum(claimed)
+        self._issued.update(compress(qr_hashes, claimed))
+        self.qr_codes = deque(filterfalse(self._issued.__contains__, self.qr_codes))
+        unclaimed_qr_codes = list(
+            set(compress(qr_hashes, map(not_, claimed))).difference(self._issued, self.qr_codes)
+        )
+        # Each worker holds its own copy of the codes; shuffle them so that workers
+        # don't all hand out the same code first
+        random.shuffle(unclaimed_qr_codes)
+        self.qr_codes.extend(unclaimed_qr_codes)
+
+    async def claim_qr_get_secret(self, qr_code: str) -> str | None:
+        """
+        Return the secret required to claim qr_code, or None if it has already been
+        claimed.
+        """
+        content = await self.get_qr_claim(qr_code)
+        if content["claimed"]:
+            return None
         assert int(content["event"]["id"]) == int(
             self.event_id
         ), f"Expected event id {self.event_id}, got {content['event']['id']}"
         # TODO: check current data not past expiry date.
         return content["secret"]
 
-    def claim_qr(self, qr_code: str, qr_secret: str, to_address: str) -> requests.Response:
+    async def get_qr_claim(self, qr_code: str) -> dict:
+        """
+        Return the POAP API's claim details for qr_code (whether and by whom it has
+        been claimed, its secret and event).
+        """
+        response = await self.poap_api.get(f"actions/claim-qr?qr_hash={qr_code}")
+        if response.status_code != 200:
+            raise Exception(
+                f"Unexpected status code fetching qr claim: {response.status_code}: "
+                f"{response.reason_phrase}, {response.text}"
+            )
+        return orjson.loads(response.content)
+
+    async def claim_qr(self, qr_code: str, qr_secret: str, to_address: str) -> httpx.Response:
         payload = {"address": to_address, "qr_hash": qr_code, "secret": qr_secret}
-        response = self.poap_api.post("actions/claim-qr", payload)
+        response = await self.poap_api.post("actions/claim-qr", payload)
         return response
 
-    def mint_poap(self, to_address: str):
-        if not self.is_eligible(to_address):
-            return {
-                "success": False,
-                "message": (
-                    f"the address {to_address} is not eligible for the poap from the "
-                    f"event id {self.event_id}",
-                ),
-            }
-        if self.has_collected(to_address):
-            return {
-                "success": False,
-                "message": (
-                    f"the address {to_address} has already collected the poap for "
-                    f"event id {self.event_id}"
-                ),
-            }
-        if not self.qr_codes:
-            return {
-                "success": False,
-                "message": (
-                    f"this event {self.event_id} has no run out of claim codes, "
-                    "please inform the organizers"
-                ),
-            }
-        qr_code = self.qr_codes.pop()
-        qr_secret = self.claim_qr_get_secret(qr_code)
-        poap_response = self.claim_qr(qr_code, qr_secret, to_address)
+    async def mint_poap(self, to_address: str, already_eligible: bool = False):
+        """
+        Mint a POAP to to_address if it's eligible and hasn't collected it yet.
+
+        Concurrent mints to the same address (double clicks, retries) share one
+        attempt, so that they can't each claim a code before the first lands.
+        """
+        return await self._single_flight(
+            ("mint_poap", to_address), lambda: self._mint_poap(to_address, already_eligible)
+        )
+
+    async def _mint_poap(self, to_address: str, already_eligible: bool) -> dict:
+        status = await self.get_collector_status(to_address, already_eligible)
+        if status is CollectorStatus.has_collected:
+            return self._has_collected_response(to_address)
+        if status is CollectorStatus.is_not_eligible:
+            return self._not_eligible_response(to_address)
+        return await self._claim_next_qr_code(to_address)
+
+    async def mint_poap_batch(
+        self, to_addresses: list[str], record_latency: Callable[[float], None] | None = None
+    ) -> list:
+        """
+        Mint POAPs to several addresses, returning the `mint_poap()` response (or
+        the exception raised) for each address.
+
+        The addresses are checked and minted to concurrently rather than one
+        address after another; repeated addresses are minted to once and share the
+        response. If given, record_latency is called with each mint's duration in
+        seconds.
+        """
+        unique_addresses = list(dict.fromkeys(to_addresses))
+        responses = await asyncio.gather(
+            *[self._timed_mint_poap(address, record_latency) for address in unique_addresses],
+            return_exceptions=True,
+        )
+        response_by_address = dict(zip(unique_addresses, responses))
+        return [response_by_address[address] for address in to_addresses]
+
+    async def _timed_mint_poap(self, to_address: str, record_latency) -> dict:
+        t0 = time.monotonic()
+        try:
+            return await self.mint_poap(to_address)
+        finally:
+            if record_latency is not None:
+                record_latency(time.monotonic() - t0)
+
+    def _not_eligible_response(self, to_address: str) -> dict:
+        return {
+            "success": False,
+            "message": (
+                f"the address {to_address} is not eligible for the poap from the "
+                f"event id {self.event_id}"
+            ),
+        }
+
+    def _has_collected_response(self, to_address: str) -> dict:
+        return {
+            "success": False,
+            "message": (
+                f"the address {to_address} has already collected the poap for "
+                f"event id {self.event_id}"
+            ),
+        }
+
+    async def _claim_next_qr_code(self, to_address: str) -> dict:
+        while True:
+            if not self.qr_codes:
+                return {
+                    "success": False,
+                    "message": (
+                        f"this event {self.event_id} has no run out of claim codes, "
+                        "please inform the organizers"
+                    ),
+                }
+            qr_code = self.qr_codes.popleft()
+            self._issued.add(qr_code)
+            try:
+                qr_secret = await self.claim_qr_get_secret(qr_code)
+            except Exception:
+                # Nothing has been claimed with the code yet; keep it for the next mint
+                self._issued.discard(qr_code)
+                self.qr_codes.appendleft(qr_code)
+                raise
+            # Skip codes that have been claimed by another worker since our last update
+            if qr_secret is None:
+                continue
+            poap_response = await self.claim_qr(qr_code, qr_secret, to_address)
+            if poap_response.status_code == 200:
+                break
+            # Another worker may have claimed the code after we fetched its secret
+            if not await self._is_claimed_by_other(qr_code, to_address):
+                break
         if poap_response.status_code != 200:  # 500 already minted?
             return {
                 "success": False,
-                "poap_api_response": poap_response,
+                "poap_api_response": poap_response.text,
                 "message": (
                     f"Unexpected status code whilst minting: {poap_response.status_code}: "
-                    f"{poap_response.reason}, {poap_response.text}"
+                    f"{poap_response.reason_phrase}, {poap_response.text}"
                 ),
             }
-        poap_response_content = json.loads(poap_response.content)
+        poap_response_content = orjson.loads(poap_response.content)
+        self._collected.add(to_address)
         return {
             "success": True,
             "message": "POAP successfully minted",
@@ -255,36 +656,61 @@ class EventABC(ABC):
             "uid": poap_response_content["queue_uid"],
         }
 
-    def wait_to_be_eligible_and_mint_poap(self, to_address: str, timeout: int):
-        t0 = time.time()
+    async def _is_claimed_by_other(self, qr_code: str, to_address: str) -> bool:
+        content = await self.get_qr_claim(qr_code)
+        beneficiary = content.get("beneficiary") or ""
+        return content["claimed"] and beneficiary.lower() != to_address.lower()
+
+    async def wait_to_be_eligible_and_mint_poap(self, to_address: str, timeout: int):
+        """
+        Poll is_eligible with capped exponential backoff (plus jitter, so waiting
+        addresses don't poll in lockstep) and mint the POAP once it returns True.
+
+        Cached eligibility isn't dropped between polls: implementations key it by
+        block (see DevconEvent), so a poll only reads the chain again once it moved.
+        """
+        deadline = time.monotonic() + timeout
+        delay = 0.5
         while True:
-            if self.is_eligible(to_address):
-                response = self.mint_poap(to_address)
+            if await self.is_eligible(to_address):
+                response = await self.mint_poap(to_address, already_eligible=True)
                 break
-            if time.time() > t0 + timeout:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
                 raise Exception(f"Address not eligible within {timeout}s")
-            time.sleep(4.0)
+            await asyncio.sleep(min(delay + random.uniform(0, delay * 0.1), remaining))
+            delay = min(delay * 2, 30.0)
         return response
 
-    def wait_for_mint_tx_hash(self, uid: str) -> dict:
+    async def wait_for_mint_tx_hash(self, uid: str) -> dict:
         mint_timeout = 15
         t0 = time.time()
         while True:
-            poap_response = self.get_uid_status(uid)
-
-            response = json.loads(poap_response.content)
+            response = await self.get_uid_status(uid)
             if response["status"] == "FINISH":
                 break
-            time.sleep(1.0)
+            await asyncio.sleep(1.0)
             if time.time() > t0 + mint_timeout:
                 raise Exception(f"POAP did not mint within {mint_timeout}s")
         return response
 
-    def get_uid_status(self, uid: str) -> requests.Response:
-        poap_response = self.poap_api.get(f"queue-message/{uid}", protected=False)
+    async def get_uid_status(self, uid: str) -> dict:
+        """
+        Return the POAP API's queue message for a mint's uid. Responses are cached
+        briefly, or for longer once the mint has finished, as clients poll them.
+        """
+        status = self._uid_status_cache.get(uid)
+        if status is not None:
+            return status
+        return await self._single_flight(("get_uid_status", uid), lambda: self._get_uid_status(uid))
+
+    async def _get_uid_status(self, uid: str) -> dict:
+        poap_response = await self.poap_api.get(f"queue-message/{uid}", protected=False)
         if poap_response.status_code != 200:  # 500 already minted?
             raise Exception(
                 f"Unexpected status code: {poap_response.status_code}: "
-                f"{poap_response.reason}, {poap_response.text}"
+                f"{poap_response.reason_phrase}, {poap_response.text}"
             )
-        return poap_response
+        status = orjson.loads(poap_response.content)
+        self._uid_status_cache[uid] = status
+        return status
@@ -1,13 +1,19 @@
 # requires "pip install -e ." in base directory
+import asyncio
 import importlib
 import logging
+import mmap
 import os
+import queue
+import re
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener
 
-import yaml
+import orjson
 from dotenv import load_dotenv
-from web3 import Web3
 
 import app.wen_poap as wen_poap
+from app.config import load_config
 
 importlib.reload(logging)  # prevent duplicate lines in ipython
 
@@ -23,50 +29,143 @@ address_whitelist_txt = "./address_list_contributed_and_voted.txt"
 
 wen_poap_config_yml = "../config.yaml"
 
+# Client-side cap on POAP API requests (each mint takes two), on top of backing
+# off as the API's rate limit headers ask; None to rely on the headers alone
+max_requests_per_minute = 600
+
+ADDRESS_RE = re.compile(r"0x[0-9a-fA-F]{40}")
+
 
 class WhitelistedEvent(wen_poap.EventABC):
-    def __init__(self, *args, config=None):
+    def __init__(self, *args, config=None, whitelist=()):
         super().__init__(*args)
+        self._whitelist = frozenset(whitelist)
 
-    def is_eligible(self, to_address):
+    async def is_eligible(self, to_address):
         """
-        Check whether an address is eligible for the POAP.
+        Check whether an address is eligible for the POAP, i.e. on the whitelist.
         """
-        return True
+        return to_address in self._whitelist
 
+    async def initialize(self):
+        await super().initialize()
+        await self.update_collectors()
 
-if __name__ == "__main__":
+    async def update_collectors(self, page_size=300):
+        """
+        Fetch the addresses already holding the event's POAP, so that has_collected
+        is answered without a request per address.
+        """
+        offset = 0
+        while True:
+            response = await self.poap_api.get(
+                f"event/{self.event_id}/poaps?limit={page_size}&offset={offset}", protected=False
+            )
+            if response.status_code != 200:
+                raise Exception(
+                    f"Unexpected status code: {response.status_code}, {response.reason_phrase}, "
+                    f"{response.text}"
+                )
+            content = orjson.loads(response.content)
+            tokens = content["tokens"]
+            self._collected.update(
+                wen_poap.checksum_address(token["owner"]["id"]) for token in tokens
+            )
+            offset += len(tokens)
+            # The API may return smaller pages than asked for; page until the total
+            if not tokens or offset >= content["total"]:
+                break
+        logging.info(f"{len(self._collected)} addresses have already collected the POAP.")
 
-    logFormatter = logging.Formatter(
-        "%(asctime)s [%(levelname)-5.5s]  %(message)s", "%Y-%m-%d %H:%M:%S"
-    )
-    rootLogger = logging.getLogger()
-    rootLogger.setLevel(logging.DEBUG)
+    async def has_collected(self, address):
+        # Addresses minted to since update_collectors() are added by EventABC
+        return address in self._collected
 
-    fileHandler = logging.FileHandler(f"{os.path.splitext(address_whitelist_txt)[0]}.log")
-    fileHandler.setFormatter(logFormatter)
-    rootLogger.addHandler(fileHandler)
 
-    consoleHandler = logging.StreamHandler()
-    consoleHandler.setFormatter(logFormatter)
-    rootLogger.addHandler(consoleHandler)
-
-    # Load addresses
-    with open(address_whitelist_txt, "r") as f:
-        addresses = f.read().splitlines()
-
-    # addresses = addresses[0:2]
-    assert all([Web3.isAddress(address) for address in addresses]), "invalid address in whitelist"
-    addresses = [Web3.toChecksumAddress(address) for address in addresses]
-    logging.info(
-        f"Will mint POAPs for event {event_id_whitelist} "
-        f"(https://poap.gallery/r/event/{event_id_whitelist})..."
-    )
-    logging.info(f"...to {len(addresses)} addresses.")
+class AimdConcurrency:
+    """
+    Additive-increase/multiplicative-decrease controller for the number of POAPs
+    minted concurrently: grow by alpha per batch while the mean latency of the
+    last `window` mints stays below target_latency, shrink by a factor beta once
+    it exceeds it or the POAP API rate limits us.
+
+    Each mint takes two sequential POAP API round trips (fetching a code's secret,
+    then claiming it), hence the default target of 2s.
+    """
+
+    def __init__(
+        self, initial=4, minimum=1, maximum=50, alpha=0.5, beta=0.5, target_latency=2.0, window=20
+    ):
+        self.concurrency = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.alpha = alpha
+        self.beta = beta
+        self.target_latency = target_latency
+        self.latencies = deque(maxlen=window)
+
+    @property
+    def limit(self):
+        return int(self.concurrency)
+
+    def record(self, latency):
+        self.latencies.append(latency)
+
+    def update(self, rate_limited=False):
+        if rate_limited:
+            self.decrease()
+            return
+        if not self.latencies:
+            return
+        mean_latency = sum(self.latencies) / len(self.latencies)
+        if mean_latency > self.target_latency:
+            self.decrease()
+        else:
+            self.concurrency = min(self.maximum, self.concurrency + self.alpha)
+
+    def decrease(self):
+        self.concurrency = max(self.minimum, self.concurrency * self.beta)
+        # Judge the new limit by its own latencies, rather than decreasing again on
+        # samples taken at the old one
+        self.latencies.clear()
+
+
+def read_whitelist(filename):
+    """
+    Return the non-empty lines of the whitelist file.
+    """
+    with open(filename, "rb") as f:
+        # Empty files can't be memory-mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Read the lines straight from the mapped file, without copying it whole
+            lines = (line.rstrip(b"\r\n") for line in iter(mm.readline, b""))
+            return [line.decode("ascii") for line in lines if line]
+
+
+def normalize_addresses(addresses):
+    """
+    Validate and checksum whitelist addresses in a single pass, failing on the
+    first invalid one.
+    """
     for address in addresses:
-        logging.info(address)
-    input("Press any key to continue...")
+        checksummed = wen_poap.parse_address(address) if ADDRESS_RE.fullmatch(address) else None
+        if checksummed is None:
+            raise ValueError(f"invalid address in whitelist: {address}")
+        yield checksummed
 
+
+def log_mint_response(index, address, response):
+    if isinstance(response, Exception):
+        logging.error(f"{index} {address}: exception {response}")
+    elif response["success"]:
+        logging.info(f"{index} {address}: success: https://app.poap.xyz/scan/{address}")
+    else:
+        logging.error(f"{index} {address}: {response['message']}")
+
+
+async def mint_poaps(addresses):
     # Load POAP API credentials from the environment
     api_key = os.environ.get("API_KEY")
     client_id = os.environ.get("CLIENT_ID")
@@ -76,31 +175,86 @@ if __name__ == "__main__":
 
     # Initialize API wrapper; get oauth token
     poap_api = wen_poap.PoapApiWrapper(
-        "https://api.poap.tech/", audience, api_key, client_id, client_secret
+        "https://api.poap.tech/",
+        audience,
+        api_key,
+        client_id,
+        client_secret,
+        max_requests_per_minute=max_requests_per_minute,
     )
+    await poap_api.initialize()
 
     # Load configured events
-    with open(wen_poap_config_yml, "r") as file:
-        config = yaml.safe_load(file)
+    config = load_config(wen_poap_config_yml)
 
     # Get event secrets and initialize event
     event = None
-    for event_config in config["discarbon_poap_dispenser_api"]["events"]:
-        event_id = event_config["id"]
+    for event_config in config.events:
+        event_id = event_config.id
         event_secret = os.environ.get(f"SECRET_EVENT_{event_id}")
         if event_id == event_id_whitelist:
-            event = WhitelistedEvent(poap_api, event_id, event_secret, config=event_config)
+            event = WhitelistedEvent(
+                poap_api, event_id, event_secret, config=event_config, whitelist=addresses
+            )
+            await event.initialize()
 
     assert event, f"Didn't find event {event_id_whitelist} in {wen_poap_config_yml}"
 
-    # Mint POAPs
-    for index, address in enumerate(addresses):
-        try:
-            response = event.mint_poap(address)
-        except Exception as e:
-            logging.error(f"{index} {address}: exception {e}")
-            continue
-        if response["success"]:
-            logging.info(f"{index} {address}: success: https://app.poap.xyz/scan/{address}")
-        else:
-            logging.error(f"{index} {address}: {response['message']}")
+    # Mint POAPs in batches whose size follows the observed mint latency and rate
+    # limiting; the mints in each batch run concurrently
+    aimd = AimdConcurrency()
+    index = 0
+    while index < len(addresses):
+        batch = addresses[index : index + aimd.limit]
+        rate_limited_responses = poap_api.rate_limited_responses
+        responses = await event.mint_poap_batch(batch, record_latency=aimd.record)
+        for i, (address, response) in enumerate(zip(batch, responses)):
+            log_mint_response(index + i, address, response)
+        index += len(batch)
+        aimd.update(rate_limited=poap_api.rate_limited_responses > rate_limited_responses)
+        logging.debug(f"Minting batch size: {aimd.limit}")
+
+    await poap_api.aclose()
+
+
+if __name__ == "__main__":
+
+    logFormatter = logging.Formatter(
+        "%(asctime)s [%(levelname)-5.5s]  %(message)s", "%Y-%m-%d %H:%M:%S"
+    )
+    rootLogger = logging.getLogger()
+    rootLogger.setLevel(logging.DEBUG)
+
+    fileHandler = logging.FileHandler(
+        f"{os.path.splitext(address_whitelist_txt)[0]}.log", delay=True, errors="replace"
+    )
+    fileHandler.setFormatter(logFormatter)
+
+    consoleHandler = logging.StreamHandler()
+    consoleHandler.setFormatter(logFormatter)
+
+    # Hand records to a background thread that writes them out, so that logging
+    # each mint doesn't block the event loop on file and console I/O
+    logQueue = queue.SimpleQueue()
+    rootLogger.addHandler(QueueHandler(logQueue))
+    logListener = QueueListener(logQueue, fileHandler, consoleHandler)
+    logListener.start()
+
+    try:
+        # Load addresses
+        addresses = read_whitelist(address_whitelist_txt)
+
+        # addresses = addresses[0:2]
+        addresses = list(normalize_addresses(addresses))
+        logging.info(
+            f"Will mint POAPs for event {event_id_whitelist} "
+            f"(https://poap.gallery/r/event/{event_id_whitelist})..."
+        )
+        logging.info(f"...to {len(addresses)} addresses.")
+        for address in addresses:
+            logging.info(address)
+        input("Press any key to continue...")
+
+        asyncio.run(mint_poaps(addresses))
+    finally:
+        logListener.stop()
@@ -1,16 +1,23 @@
-import json
+# requires "pip install -e ." in base directory
+from functools import lru_cache
+from pathlib import Path
 
+import orjson
+import requests
+from eth_abi import decode_abi
 from web3 import Web3
 
+from app.batching import MULTICALL3_ABI, MULTICALL3_ADDRESS
 
+
+@lru_cache(maxsize=None)
 def load_abi(filename):
-    with open(filename, "r") as f:
-        abi = json.load(f)
-    return abi
+    return orjson.loads(Path(filename).read_bytes())
 
 
 rpc_url = "https://poly-rpc.gateway.pokt.network/"
-web3 = Web3(Web3.HTTPProvider(rpc_url))
+# Share one keep-alive connection between all requests to the node
+web3 = Web3(Web3.HTTPProvider(rpc_url, session=requests.Session()))
 block_number = web3.eth.blockNumber
 print(f"Connected: {web3.isConnected()}, block number: {block_number}")
 
@@ -22,8 +29,17 @@ abi_filename = (
 abi = load_abi(abi_filename)
 pooling_contract = web3.eth.contract(address=contract_address, abi=abi)
 
-contributor_addresses = pooling_contract.functions.getContributorsAddresses().call()
-contributed_nct = pooling_contract.functions.totalCarbonPooled().call()
+# Read both values in one round trip with Multicall3, at the same block
+multicall = web3.eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
+calls = [
+    (contract_address, False, Web3.toBytes(hexstr=pooling_contract.encodeABI(fn_name=fn_name)))
+    for fn_name in ("getContributorsAddresses", "totalCarbonPooled")
+]
+(_, contributors_data), (_, pooled_data) = multicall.functions.aggregate3(calls).call(
+    block_identifier=block_number
+)
+contributor_addresses = decode_abi(["address[]"], contributors_data)[0]
+contributed_nct = decode_abi(["uint256"], pooled_data)[0]
 
 print("Contributor count: ", len(contributor_addresses))
 print("Amount of NCT contributed:", web3.fromWei(contributed_nct, "ether"))